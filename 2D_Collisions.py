@@ -1,6 +1,8 @@
 import pygame
+import numpy as np  # For storing the particles' attributes in arrays.
 import math    # For trigonometry.
-import random  # For random generation of particles and their attributes.
+
+import physics  # For moving the particles and resolving their collisions.
 
 
 # Simulation Constants
@@ -8,277 +10,53 @@ NUM_PARTICLES = 10
 ELASTICITY_COEFFICIENT = 0.8
 DRAG_COEFFICIENT = 0.9999
 MOUSE_FLING_COEFFICIENT = 0.1
+NEIGHBOR_SKIN = 4.0
+# The window is redrawn at most FRAME_RATE times per second, and the physics
+# is stepped PHYSICS_RATE times per second no matter how often frames are
+# drawn, so the particles move at the same speed on every computer. If the
+# physics falls more than MAX_PHYSICS_STEPS_PER_FRAME steps behind, the extra
+# time is skipped rather than simulated all at once.
+FRAME_RATE = 60
+PHYSICS_RATE = 120
+MAX_PHYSICS_STEPS_PER_FRAME = 8
 
 
-class Vector:
-    """A 2D vector whose x and y components correspond to the x and y
-    components of a particle's velocity, respectively."""
-
-    def __init__(self, x, y):
-        self._x_comp = x
-        self._y_comp = y
-
-    def x(self) -> int or float:
-        return self._x_comp
-
-    def y(self) -> int or float:
-        return self._y_comp
-
-    def unit(self):
-        """Return a unit vector with the same direction as this one."""
-        return Vector(
-            self._x_comp / self.magnitude(),
-            self._y_comp / self.magnitude()
-        )
-
-    def magnitude(self):
-        """Return this vector's magnitude."""
-        return math.hypot(self._x_comp, self._y_comp)
-
-    def __mul__(self, right):
-        """Overload multiplication to perform the dot product operation if
-        between two vectors, otherwise multiply the components by a provided factor."""
-        if type(right) == Vector:
-            return (self._x_comp * right._x_comp) + (self._y_comp * right._y_comp)
-        elif type(right) in (int, float):
-            return Vector(self._x_comp * right, self._y_comp * right)
-        else:
-            raise NotImplemented(f"Multiplication not supported between Vector and {type(right)}.")
-
-    def __add__(self, right):
-        if type(right) != Vector:
-            raise NotImplemented(f"Addition not supported between Vector and {type(right)}")
-        else:
-            return Vector(self._x_comp + right._x_comp, self._y_comp + right._y_comp)
+class Particle:
+    """A particle, represented by a circle.
 
+    The attributes of every particle are stored in the Simulation's arrays, so
+    a Particle only refers to one index of those arrays. It is used for the
+    click-and-drag functionality."""
 
-class Particle:
-    """A particle, represented by a circle."""
+    __slots__ = ('_index', '_x', '_y', '_vx', '_vy')
 
     def __init__(
         self,
-        position: (int, int),
-        mass: int,
-        radius: int,
-        speed: float,
-        angle: float,
-        color: (int, int, int)
+        index: int,
+        position: (np.ndarray, np.ndarray),
+        velocity: (np.ndarray, np.ndarray)
     ):
+        self._index = index
         self._x, self._y = position
-        self._color = color
-        self._mass = mass
-        self._radius = radius
-        # Attributes related to movement.
-        self._speed_x = math.cos(angle) * speed
-        self._speed_y = math.sin(angle) * speed
-        self._speed = speed
-        self._angle = angle
-
-    # These three member functions are for use with the click-and-drag functionality.
+        self._vx, self._vy = velocity
+
     def x(self) -> float:
-        return self._x
+        return self._x[self._index]
 
     def y(self) -> float:
-        return self._y
-
-    def radius(self) -> int:
-        return self._radius
-
-    def display(self, surface: pygame.Surface):
-        """Draw a circle representing this particle on the display."""
-        pygame.draw.circle(
-            surface,
-            self._color,
-            # Math.floor ensures integer arguments are given. This pygame function
-            # only accepts integers.
-            (math.floor(self._x), math.floor(self._y)),
-            self._radius
-        )
-
-    def move(self, surface: pygame.Surface) -> None:
-        """Move the particle in the direction it's pointing."""
-        self._x += self._speed_x
-        self._y += self._speed_y
-        self._bounce(surface)
-        self._apply_drag()
+        return self._y[self._index]
 
     def follow(self, mouse_coodinates: (int, int)) -> None:
         """Change the particle's vector to point towards the mouse cursor."""
-        dx = mouse_coodinates[0] - self._x
-        dy = mouse_coodinates[1] - self._y
-        # Calculate a new speed for the particle based on the distance between the
-        # two points.
-        self._speed = math.hypot(dx, dy)
-        # Math.atan2(dy, dx) will calculate the particle's new direction, which will
-        # be pointing towards the mouse cursor's coordinates.
-        self._recalculate_speed_components(math.atan2(dy, dx), MOUSE_FLING_COEFFICIENT)
-        # Multiplying by MOUSE_FLING_COEFFICIENT slows down the particle enough to let
-        # the mouse cursor get ahead, and enables a realistic-looking flinging effect.
-
-    def collide(self, p2) -> None:
-        """Resolve a collision with another particle p2."""
-        if self._is_colliding(p2):
-            # When two particles collide, there are two "vectors" that represent
-            # the collision: a tangential vector, which is tangent to the two
-            # particles; and a normal vector, which goes through the centers of
-            # the particles.
-
-            # The particles do not move in the tangential direction, only the normal direction.
-            # To find a normal vector, we simply have a vector whose components are the differences
-            # between the coordinates of the two colliding particles.
-            n_vec = Vector(self._x - p2._x, self._y - p2._y)
-
-            # The tangent vector's x component is the negative of the normal
-            # vector's y, and its y is the normal's x.
-            t_vec = Vector(-n_vec.y(), n_vec.x())
-
-            # We also need unit vectors corresponding to the previous two, so
-            # that we can project the particles's vectors onto the unit vectors
-            # and calculate final velocity vectors.
-            unit_n_vec = n_vec.unit()
-            unit_t_vec = t_vec.unit()
-
-            # Now we need vectors corresponding to the two particles' speeds.
-            p1_initial_vec = Vector(self._speed_x, self._speed_y)
-            p2_initial_vec = Vector(p2._speed_x, p2._speed_y)
-
-            # Now we use the dot product of each particle's velocity vectors
-            # with the unit vectors to find the tangential and normal components
-            # of each vector's velocity.
-            #
-            # Remember that the tangential components of each vector's velocity
-            # does not change, so there are no "initial" tangential components.
-            p1_initial_norm_comp = p1_initial_vec * unit_n_vec
-            p1_tan_comp = p1_initial_vec * unit_t_vec
-
-            p2_initial_norm_comp = p2_initial_vec * unit_n_vec
-            p2_tan_comp = p2_initial_vec * unit_t_vec
-
-            # Now that we've projected each particle's velocity vector onto the
-            # unit normal vectors, we can use Newton's 1-dimensional collision
-            # equation to calculate the final normal components of each particle's
-            # velocity.
-            p1_final_norm_comp = ( (p1_initial_norm_comp * (self._mass - p2._mass)
-                                    + 2 * p2._mass * p2_initial_norm_comp) 
-                                    / (self._mass + p2._mass) )
-
-            p2_final_norm_comp = ( (p2_initial_norm_comp * (p2._mass - self._mass)
-                                    + 2 * self._mass * p1_initial_norm_comp)
-                                    / (self._mass + p2._mass) )
-
-            # Now that we have the final normal components of each velocity, we
-            # multiply them by the unit normal vector to get the final normal vectors
-            # for each particle.
-            p1_final_n_vec = unit_n_vec * p1_final_norm_comp
-            p2_final_n_vec = unit_n_vec * p2_final_norm_comp
-            # Do the same for the tangential vectors, which didn't change.
-            p1_final_t_vec = unit_t_vec * p1_tan_comp
-            p2_final_t_vec = unit_t_vec * p2_tan_comp
-
-            # Now we add the normal and tangential vectors for each particle together
-            # to get their final complete vectors.
-            p1_final_vec = p1_final_n_vec + p1_final_t_vec
-            p2_final_vec = p2_final_n_vec + p2_final_t_vec
-
-            # Now we have to change this vector form of velocity into an angle and
-            # speed that we can use to move the particle around using our move function.
-            self._speed = p1_final_vec.magnitude()
-            self._angle = math.atan2(p1_final_vec.y(), p1_final_vec.x())
-            self._recalculate_speed_components(self._angle)
-
-            # Do the same for p2.
-            p2._speed = p2_final_vec.magnitude()
-            p2._angle = math.atan2(p2_final_vec.y(), p2_final_vec.x())
-            p2._recalculate_speed_components(p2._angle)
-
-            # Apply elasticity to both particles to simulate the loss of energy
-            # during the collision.
-            self._apply_elasticity()
-            p2._apply_elasticity()
-
-            # Because this is a discrete simulation, we need to push the particles apart
-            # by the distance that they overlap, this is to prevent the particles from
-            # sticking to each other if they overlap between frames.
-            self._push_apart(p2)
-
-    def _push_apart(self, p2) -> None:
-        """Push this particle and p2 apart by the distance that they overlap."""
-        # To find the amount of overlap, we subtract the distance between
-        # the particles from the sum of their radiuses.
-        dist = self._overlap_amount(p2)
-
-        # Then we need the angle of collision.
-        collision_angle = math.atan2(self._y - p2._y, self._x - p2._x)
-
-        # Now we need to update the x and y positions of each particle accordingly.
-        self._x += math.cos(collision_angle) * dist
-        self._y += math.sin(collision_angle) * dist
-        p2._x -= math.cos(collision_angle) * dist
-        p2._y -= math.sin(collision_angle) * dist
-
-    def _overlap_amount(self, p2) -> float:
-        """Return the amount of overlap between two particles."""
-        x_dif = self._x - p2._x
-        y_dif = self._y - p2._y
-        return (self._radius + p2._radius) - math.hypot(x_dif, y_dif)
-
-    def _is_colliding(self, p2) -> bool:
-        """Return True if the distance between the particles is less than the
-        sum of their radiuses, otherwise return False."""
-        return self._overlap_amount(p2) > 0
-
-    def _bounce(self, surface: pygame.Surface) -> None:
-        """Bounce off the edge of the display."""
-        width, height = surface.get_size()
-        # Top-of-window collision.
-        if self._y <= self._radius:
-            # Update angle to deflect off of surface.
-            self._recalculate_speed_components(-self._angle)
-            # Update position to prevent an out-of-bounds situation.
-            # This is necessary because this is a discrete simulation, and
-            # the particle can be in bounds on frame, and out the next, so we have
-            # to update the position to make it look like the particle just bounced
-            # off the surface.
-
-            # We add here because we're deflecting off of the top, and the y-axis is
-            # flipped such that to go downwards, we add -- and subtract for going
-            # upwards.
-            self._y += 2 * (self._radius - self._y)
-        # Bottom-of-window collision.
-        elif self._y >= (height - self._radius):
-            self._recalculate_speed_components(-self._angle)
-            self._y -= 2 * (self._y + self._radius - height)
-        # Left-of-window collision.
-        elif self._x <= self._radius:
-            self._recalculate_speed_components(math.pi - self._angle)
-            self._x += 2 * (self._radius - self._x)
-        # Right-of-window collision.
-        elif self._x >= width - self._radius:
-            self._recalculate_speed_components(math.pi - self._angle)
-            self._x -= 2 * (self._x + self._radius - width)
-        else:
-            # If we didn't bounce off of an edge, return early without
-            # applying elasticity.
-            return
-
-        # Apply elasticity so the particle loses energy when it bounces.
-        self._apply_elasticity()
-
-    def _apply_drag(self) -> None:
-        """Update the particle's speed to simulate the effect of drag."""
-        self._recalculate_speed_components(self._angle, DRAG_COEFFICIENT)
-
-    def _apply_elasticity(self) -> None:
-        """Update the particle's speed to simulate the effect of elasticity."""
-        self._recalculate_speed_components(self._angle, ELASTICITY_COEFFICIENT)
-
-    def _recalculate_speed_components(self, new_angle: float, speed_coefficient=None) -> None:
-        """Change the x and y components of speed depending on a new angle."""
-        if speed_coefficient:
-            self._speed *= speed_coefficient
-        self._angle = new_angle
-        self._speed_x = math.cos(new_angle) * self._speed
-        self._speed_y = math.sin(new_angle) * self._speed
+        dx = mouse_coodinates[0] - self.x()
+        dy = mouse_coodinates[1] - self.y()
+        # The vector from the particle to the mouse cursor already points in the
+        # right direction, and its length gives a speed based on the distance
+        # between the two points. Multiplying by MOUSE_FLING_COEFFICIENT slows down
+        # the particle enough to let the mouse cursor get ahead, and enables a
+        # realistic-looking flinging effect.
+        self._vx[self._index] = dx * MOUSE_FLING_COEFFICIENT
+        self._vy[self._index] = dy * MOUSE_FLING_COEFFICIENT
 
 
 class Simulation:
@@ -296,49 +74,107 @@ class Simulation:
         # Fill the background with white and set a caption for the window.
         self._surface.fill((255, 255, 255))
         pygame.display.set_caption("2D Collisions")
-
-        # Fill the window with randomly created particles.
-        self._particles = self._generate_particles(NUM_PARTICLES)
+        pygame.display.flip()
+        # Only the parts of the window where particles were or are now get redrawn
+        # each frame. A copy of the empty background is kept for erasing the
+        # particles, along with the areas they were drawn at in the last frame.
+        self._background = self._surface.copy()
+        self._dirty_rects = []
+        # When the window has been covered, minimized or moved off screen, the
+        # whole of it has to be shown again, not just the particles' areas.
+        self._window_exposed = False
+        # Only the events handled in run() are let into the event queue, so that
+        # events like mouse motion don't pile up and get looped over every frame.
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed([
+            pygame.QUIT, pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP,
+            pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE
+        ])
+        # The clock is used to limit how many frames are drawn per second.
+        self._clock = pygame.time.Clock()
+
+        # Fill the window with randomly created particles. Rather than keeping a
+        # list of particle objects, each attribute of the particles is stored in
+        # its own array, where index i holds the attribute of the i-th particle.
+        # This lets the physics step loop over plain arrays of numbers.
+        self._generate_particles(NUM_PARTICLES)
+        # Drawing a circle from scratch is slow, so each particle's circle is
+        # drawn once onto a small transparent surface, which is copied onto the
+        # window every frame instead.
+        self._sprites = self._create_sprites()
+        # Each particle keeps a list of the particles that are within
+        # NEIGHBOR_SKIN pixels of touching it, and only checks those for
+        # collisions. The lists are only rebuilt once a particle has moved far
+        # enough that it could touch a particle that isn't in them.
+        self._x0 = np.empty_like(self._x)
+        self._y0 = np.empty_like(self._y)
+        self._neighbor_starts, self._neighbors = physics.build_neighbor_lists(
+            self._x, self._y, self._radius, self._width, self._height,
+            NEIGHBOR_SKIN, self._x0, self._y0
+        )
         # This attribute determines whether or not we have selected a particle
         # by clicking on one, which lets us drag and throw it around.
         self._selected_particle = None
 
-    def _generate_particles(self, num: int) -> [Particle]:
+    def _generate_particles(self, num: int) -> None:
         """Generate num random particles."""
-        particles = []
-        for _ in range(num):
-            # First, give the particle a radius.
-            radius = random.randint(2, 20)
-            # Then, determine a position for the particle, within the bounds of the window.
-            pos_x = random.randint(radius, self._width - radius)
-            pos_y = random.randint(radius, self._height - radius)
-            # Now, determine an angle and speed for the particle.
-            angle = random.uniform(0, 2 * math.pi)
-            speed = random.random()
-            # We can also calculate a "density" for the particle, which we can use
-            # to shift the color of the particle and calculate a mass.
-            density = random.randint(1, 20)
-            # Create and append a particle to the list of particles.
-
-            # The mass is calculated by re-arranging the formula for density (d = m/V),
-            # except instead of volume we use area of a circle.
-
-            # Additionally, the color is deterimined by subtracting the density * 10 from
-            # 255 from the G and B values, which means that denser particles will be darker
-            # than less dense ones.
-            particles.append(Particle(
-                (pos_x, pos_y),
-                density * math.pi * (radius ** 2),
-                radius,
-                speed,
-                angle,
-                (255, 200 - density * 10, 200 - density * 10)
-            ))
-        return particles
+        # The attributes used by the physics are stored as 32-bit floats. They are
+        # precise enough for a window a few hundred pixels wide, and take half the
+        # memory of 64-bit floats, so the physics step has less data to read.
+
+        # First, give each particle a radius.
+        radius = np.random.randint(2, 21, num)
+        # Then, determine a position for each particle, within the bounds of the window.
+        self._x = np.random.randint(radius, self._width - radius + 1).astype(np.float32)
+        self._y = np.random.randint(radius, self._height - radius + 1).astype(np.float32)
+        # Now, determine an angle and speed for each particle, and split the speed
+        # into its x and y components.
+        angle = np.random.uniform(0, 2 * math.pi, num)
+        speed = np.random.random(num)
+        self._vx = (np.cos(angle) * speed).astype(np.float32)
+        self._vy = (np.sin(angle) * speed).astype(np.float32)
+        # We can also calculate a "density" for each particle, which we can use
+        # to shift the color of the particle and calculate a mass.
+        density = np.random.randint(1, 21, num)
+
+        # The mass is calculated by re-arranging the formula for density (d = m/V),
+        # except instead of volume we use area of a circle.
+        self._mass = (density * math.pi * (radius ** 2)).astype(np.float32)
+        self._radius = radius.astype(np.float32)
+
+        # Additionally, the color is deterimined by subtracting the density * 10 from
+        # 255 from the G and B values, which means that denser particles will be darker
+        # than less dense ones. The values are clipped to the 0-255 range pygame
+        # accepts, in case the range of densities is ever made larger.
+        self._color = np.clip(np.column_stack((
+            np.full(num, 255),
+            200 - density * 10,
+            200 - density * 10
+        )), 0, 255).astype(np.uint8)
+
+    def _create_sprites(self) -> [pygame.Surface]:
+        """Return a surface with each particle's circle drawn on it.
+
+        Particles with the same radius and color share the same surface."""
+        drawn = {}
+        sprites = []
+        for radius, color in zip(self._radius.astype(int).tolist(), self._color.tolist()):
+            key = (radius, *color)
+            if key not in drawn:
+                sprite = pygame.Surface((2 * radius, 2 * radius), pygame.SRCALPHA)
+                pygame.draw.circle(sprite, color, (radius, radius), radius)
+                # Converting the surface to the window's pixel format makes copying
+                # it onto the window faster.
+                drawn[key] = sprite.convert_alpha()
+            sprites.append(drawn[key])
+        return sprites
 
     def run(self) -> None:
         """Run the simulation."""
         self._running = True
+        physics_step_time = 1000 / PHYSICS_RATE  # In milliseconds.
+        # The time that has passed but hasn't been simulated yet.
+        lag = 0
 
         while self._running:
             for event in pygame.event.get():
@@ -351,44 +187,80 @@ class Simulation:
                     self._select_particle(event.pos)
                 elif event.type == pygame.MOUSEBUTTONUP:
                     self._deselect_particle()
-
-            self._handle_events()
+                elif event.type in (pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE):
+                    self._window_exposed = True
+
+            # Wait until it's time to draw the next frame, rather than using
+            # the CPU to redraw frames faster than the display can show them.
+            # Then step the physics as many times as fit into the time since the
+            # last frame, carrying whatever is left over to the next frame.
+            lag += self._clock.tick(FRAME_RATE)
+            lag = min(lag, MAX_PHYSICS_STEPS_PER_FRAME * physics_step_time)
+            while lag >= physics_step_time:
+                self._handle_events()
+                lag -= physics_step_time
             self._redraw_frame()
 
     def _handle_events(self) -> bool:
         """Handle pygame and particle interactions."""
         if self._selected_particle:
             self._selected_particle.follow(pygame.mouse.get_pos())
-        for index, particle in enumerate(self._particles):
-            particle.move(self._surface)
-
-            # Slicing the list of particles by index + 1 ensures that
-            # each particle only collides with every other particle once by
-            # only resolving collisions with particles that come after it in the list.
-            for other_particle in self._particles[index + 1:]:
-                particle.collide(other_particle)
+        self._neighbor_starts, self._neighbors = physics.step(
+            self._x, self._y, self._vx, self._vy, self._radius, self._mass,
+            self._width, self._height, DRAG_COEFFICIENT, ELASTICITY_COEFFICIENT,
+            NEIGHBOR_SKIN, self._x0, self._y0, self._neighbor_starts, self._neighbors
+        )
 
     def _redraw_frame(self):
-        """Redraw the background, the particles, and then flip the display."""
-        self._surface.fill((255, 255, 255))
-
-        for particle in self._particles:
-            particle.display(self._surface)
+        """Erase the particles from where they were drawn last frame, draw them at
+        their new positions, and then update those parts of the display."""
+        # Erase the particles by copying the background over where they were.
+        self._surface.blits(
+            ((self._background, rect, rect) for rect in self._dirty_rects),
+            doreturn=False
+        )
 
-        pygame.display.flip()
+        # Each sprite is copied so that its center lands on the particle's position.
+        # Flooring the positions gives the integer pixel coordinates pygame needs.
+        left = (np.floor(self._x) - self._radius).astype(int).tolist()
+        top = (np.floor(self._y) - self._radius).astype(int).tolist()
+        # Passing every sprite to blits() at once copies them all in a single call,
+        # which also returns the areas that were drawn on.
+        drawn_rects = self._surface.blits(zip(self._sprites, zip(left, top)))
+
+        # If the window was exposed, show all of it. Otherwise, each particle's
+        # old and new areas mostly overlap, so a single rect covering both is
+        # updated per particle, rather than updating the overlapping part twice.
+        if self._window_exposed:
+            pygame.display.flip()
+            self._window_exposed = False
+        elif self._dirty_rects:
+            pygame.display.update([
+                old_rect.union(new_rect)
+                for old_rect, new_rect in zip(self._dirty_rects, drawn_rects)
+            ])
+        else:
+            pygame.display.update(drawn_rects)
+        self._dirty_rects = drawn_rects
 
     def _select_particle(self, coords: (int, int)) -> None:
         """Select a particle if the mouse clicks on one."""
-        for particle in self._particles:
-            dx = coords[0] - particle.x()
-            dy = coords[1] - particle.y()
-            distance = math.hypot(dx, dy)
-            # If the distance between the point where the mouse clicked
-            # is less than the radius of the Particle, then we must have
-            # clicked inside the particle, thus selecting it.
-            if distance <= particle.radius():
-                self._selected_particle = particle
-                return
+        dx = coords[0] - self._x
+        dy = coords[1] - self._y
+        # If the distance between the point where the mouse clicked
+        # is less than the radius of the Particle, then we must have
+        # clicked inside the particle, thus selecting it. Comparing the
+        # squares of both sides saves us from taking a square root, and
+        # the distance to every particle is checked at once.
+        clicked = np.flatnonzero(dx * dx + dy * dy <= self._radius ** 2)
+        if clicked.size:
+            # Particles are drawn in order, so if the click is inside several
+            # overlapping particles, the last one is the one on top.
+            self._selected_particle = Particle(
+                int(clicked[-1]),
+                (self._x, self._y),
+                (self._vx, self._vy)
+            )
 
     def _deselect_particle(self) -> None:
         """Deselect a particle, if one is already selected. Do nothing otherwise."""
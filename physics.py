@@ -0,0 +1,258 @@
+import math    # For square roots.
+import numpy as np  # For creating the neighbor list arrays.
+
+try:
+    from numba import njit  # For compiling the physics functions to machine code.
+except ImportError:
+    # Numba is optional. Without it these functions run as regular python,
+    # which is fine for a few particles but slows down as more are added.
+    def njit(*args, **kwargs):
+        def decorator(function):
+            return function
+        return decorator
+
+
+# Grid cells checked for collisions besides a particle's own cell: east,
+# south-east, south and south-west. The other four neighbors are covered when
+# the cells on the opposite side are visited, so each pair is tested once.
+NEIGHBOR_CELL_OFFSETS = ((1, 0), (1, 1), (0, 1), (-1, 1))
+
+# When numba isn't installed the physics functions run as regular python, and
+# calling math.sqrt looks up both math and its sqrt attribute every time.
+# Binding it to a module level name once makes each call a single lookup.
+_sqrt = math.sqrt
+
+
+@njit(cache=True, fastmath=True)
+def step(
+    x, y, vx, vy, radius, mass,
+    width, height, drag, elasticity,
+    skin, x0, y0, neighbor_starts, neighbors
+):
+    """Advance every particle by one physics step: move them, bounce them off
+    of the edges of the window, apply drag, and resolve collisions between them.
+
+    The particles' attributes are arrays where index i holds the attribute of
+    the i-th particle, and are updated in place. x0, y0, neighbor_starts and
+    neighbors are the arrays made by build_neighbor_lists. They are rebuilt
+    when the particles have moved too far, so the possibly new
+    neighbor_starts and neighbors are returned."""
+    num = x.shape[0]
+    # Each particle is moved, bounced and slowed by drag in a single pass,
+    # reading its attributes from the arrays once and writing them back once.
+    # The same pass finds how far the particles have moved since the neighbor
+    # lists were built.
+    max_moved_squared = 0.0
+    for i in range(num):
+        px, py, pvx, pvy = _bounce(
+            x[i] + vx[i], y[i] + vy[i], vx[i], vy[i], radius[i], width, height, elasticity
+        )
+        x[i] = px
+        y[i] = py
+        # Update the particle's speed to simulate the effect of drag.
+        vx[i] = pvx * drag
+        vy[i] = pvy * drag
+
+        moved_x = px - x0[i]
+        moved_y = py - y0[i]
+        max_moved_squared = max(max_moved_squared, moved_x * moved_x + moved_y * moved_y)
+
+    # Two particles that weren't within skin of touching when the lists were
+    # built can only be touching now if, between them, they moved more than
+    # skin. So the lists only have to be rebuilt once a particle moves more
+    # than half of skin.
+    if max_moved_squared > (skin / 2) ** 2:
+        neighbor_starts, neighbors = build_neighbor_lists(x, y, radius, width, height, skin, x0, y0)
+
+    for i in range(num):
+        for k in range(neighbor_starts[i], neighbor_starts[i + 1]):
+            _collide(i, neighbors[k], x, y, vx, vy, radius, mass, elasticity)
+
+    return neighbor_starts, neighbors
+
+
+@njit(cache=True, fastmath=True)
+def build_neighbor_lists(x, y, radius, width, height, skin, x0, y0):
+    """Find the pairs of particles that are within skin of touching, and
+    record every particle's current position in x0 and y0.
+
+    Return the arrays neighbor_starts and neighbors, where particle i's
+    neighbors are neighbors[neighbor_starts[i]:neighbor_starts[i + 1]]. Each
+    pair is only listed once, under one of its two particles."""
+    num = x.shape[0]
+    x0[:] = x
+    y0[:] = y
+    # With no particles there are no neighbors, and no largest radius to size
+    # the grid's cells by.
+    if num == 0:
+        return np.zeros(1, dtype=np.int32), np.empty(0, dtype=np.int32)
+
+    # Sort the particles into a grid of square cells, so that we only look for
+    # neighbors among particles that are close to each other. Making the cells
+    # as wide as the largest possible neighbor distance means a particle's
+    # neighbors are all in its own cell or the 8 cells around it. The grid is
+    # stored as linked lists: cell_heads holds the first particle in each cell,
+    # and cell_next holds the particle after each particle in its cell, with -1
+    # marking the end of a list.
+    cell_size = 2 * radius.max() + skin
+    columns = int(width // cell_size) + 1
+    rows = int(height // cell_size) + 1
+    cell_heads = np.full(columns * rows, -1, dtype=np.int32)
+    cell_index = np.empty(num, dtype=np.int32)
+    cell_next = np.empty(num, dtype=np.int32)
+    for i in range(num):
+        # Particles outside of the window are put in the nearest edge cell.
+        column = min(max(int(x[i] // cell_size), 0), columns - 1)
+        row = min(max(int(y[i] // cell_size), 0), rows - 1)
+        cell = row * columns + column
+        cell_index[i] = cell
+        cell_next[i] = cell_heads[cell]
+        cell_heads[cell] = i
+
+    neighbor_starts = np.empty(num + 1, dtype=np.int32)
+    # The neighbors array grows as needed, so it starts with a rough guess.
+    neighbors = np.empty(4 * num + 16, dtype=np.int32)
+    count = 0
+    for i in range(num):
+        neighbor_starts[i] = count
+        # Following the list from the particle after i ensures that the
+        # particles in the same cell are only paired up once.
+        j = cell_next[i]
+        while j != -1:
+            if _is_neighbor(i, j, x, y, radius, skin):
+                neighbors = _append(neighbors, count, j)
+                count += 1
+            j = cell_next[j]
+
+        column = cell_index[i] % columns
+        row = cell_index[i] // columns
+        for column_offset, row_offset in NEIGHBOR_CELL_OFFSETS:
+            neighbor_column = column + column_offset
+            neighbor_row = row + row_offset
+            if 0 <= neighbor_column < columns and 0 <= neighbor_row < rows:
+                j = cell_heads[neighbor_row * columns + neighbor_column]
+                while j != -1:
+                    if _is_neighbor(i, j, x, y, radius, skin):
+                        neighbors = _append(neighbors, count, j)
+                        count += 1
+                    j = cell_next[j]
+    neighbor_starts[num] = count
+    return neighbor_starts, neighbors
+
+
+@njit(cache=True, fastmath=True)
+def _is_neighbor(i, j, x, y, radius, skin):
+    """Return True if particles i and j are within skin of touching."""
+    dx = x[i] - x[j]
+    dy = y[i] - y[j]
+    distance = radius[i] + radius[j] + skin
+    return dx * dx + dy * dy < distance * distance
+
+
+@njit(cache=True, fastmath=True)
+def _append(array, count, value):
+    """Store value at index count of array, doubling the array's size first if
+    it is full, and return the array."""
+    if count == array.shape[0]:
+        grown = np.empty(2 * count, dtype=np.int32)
+        grown[:count] = array
+        array = grown
+    array[count] = value
+    return array
+
+
+@njit(cache=True, fastmath=True)
+def _bounce(x, y, vx, vy, radius, width, height, elasticity):
+    """Bounce a particle off of an edge of the window, if it reached one, and
+    return its new position and velocity."""
+    # This is written without branches, so that it compiles to straight-line
+    # code with no hard-to-predict jumps.
+    hit_x = (x <= radius) | (x >= width - radius)
+    hit_y = (y <= radius) | (y >= height - radius)
+
+    # Update the position to prevent an out-of-bounds situation. This is
+    # necessary because this is a discrete simulation, and the particle can be
+    # in bounds on frame, and out the next, so we have to update the position
+    # to make it look like the particle just bounced off the surface. The
+    # max() terms are the distance the particle went past each edge, which is
+    # zero for the edges it didn't reach.
+    x += 2 * max(radius - x, 0.0) - 2 * max(x + radius - width, 0.0)
+    y += 2 * max(radius - y, 0.0) - 2 * max(y + radius - height, 0.0)
+
+    # Deflect off of the surface by flipping the component of the speed that
+    # points into it, and apply elasticity so the particle loses energy when
+    # it bounces.
+    speed_coefficient = elasticity if hit_x | hit_y else 1.0
+    vx *= (-1.0 if hit_x else 1.0) * speed_coefficient
+    vy *= (-1.0 if hit_y else 1.0) * speed_coefficient
+    return x, y, vx, vy
+
+
+@njit(cache=True, fastmath=True)
+def _collide(i, j, x, y, vx, vy, radius, mass, elasticity):
+    """Resolve a collision between particles i and j, if they are colliding."""
+    radius_sum = radius[i] + radius[j]
+
+    # Check the bounding boxes first. Particles that are too far apart on
+    # either axis can't be touching, and this is much cheaper than a square root.
+    dx = x[i] - x[j]
+    dy = y[i] - y[j]
+    if abs(dx) >= radius_sum or abs(dy) >= radius_sum:
+        return
+    # The particles are colliding if the distance between them is less than
+    # the sum of their radiuses. Comparing the squares of both sides saves
+    # us from taking a square root for particles that aren't colliding.
+    dist_squared = dx * dx + dy * dy
+    if dist_squared >= radius_sum * radius_sum or dist_squared == 0:
+        return
+    dist = _sqrt(dist_squared)
+
+    # When two particles collide, there are two directions that describe
+    # the collision: the tangential direction, which is tangent to the two
+    # particles; and the normal direction, which goes through the centers
+    # of the particles.
+    #
+    # The particles do not change speed in the tangential direction, only
+    # the normal direction. The unit normal vector is simply the difference
+    # between the particles' coordinates, divided by its length.
+    nx = dx / dist
+    ny = dy / dist
+
+    # Project each particle's velocity onto the unit normal vector, using
+    # the dot product, to find the normal component of its velocity.
+    p1_initial_norm_comp = vx[i] * nx + vy[i] * ny
+    p2_initial_norm_comp = vx[j] * nx + vy[j] * ny
+
+    # Now we can use Newton's 1-dimensional collision equation to calculate
+    # the final normal components of each particle's velocity.
+    m1 = mass[i]
+    m2 = mass[j]
+    p1_final_norm_comp = ( (p1_initial_norm_comp * (m1 - m2)
+                            + 2 * m2 * p2_initial_norm_comp)
+                            / (m1 + m2) )
+
+    p2_final_norm_comp = ( (p2_initial_norm_comp * (m2 - m1)
+                            + 2 * m1 * p1_initial_norm_comp)
+                            / (m1 + m2) )
+
+    # Since the tangential components don't change, we only have to add the
+    # change in the normal component to each velocity. Then we apply
+    # elasticity to both particles to simulate the loss of energy during
+    # the collision.
+    p1_change = p1_final_norm_comp - p1_initial_norm_comp
+    p2_change = p2_final_norm_comp - p2_initial_norm_comp
+    vx[i] = (vx[i] + p1_change * nx) * elasticity
+    vy[i] = (vy[i] + p1_change * ny) * elasticity
+    vx[j] = (vx[j] + p2_change * nx) * elasticity
+    vy[j] = (vy[j] + p2_change * ny) * elasticity
+
+    # Because this is a discrete simulation, we need to push the particles apart
+    # by the distance that they overlap, this is to prevent the particles from
+    # sticking to each other if they overlap between frames. To find the amount
+    # of overlap, we subtract the distance between the particles from the sum of
+    # their radiuses.
+    overlap = radius_sum - dist
+    x[i] += nx * overlap
+    y[i] += ny * overlap
+    x[j] -= nx * overlap
+    y[j] -= ny * overlap